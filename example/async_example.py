@@ -0,0 +1,20 @@
+import asyncio
+
+from ondilo.async_ondilo import AsyncOndilo
+
+
+async def main():
+    async with AsyncOndilo(redirect_uri="https://example.com/api") as client:
+        print('Please go here and authorize,', client.get_authurl())
+
+        redirect_response = input('Paste the full redirect URL here:')
+        await client.request_token(authorization_response=redirect_response)
+
+        pools = await client.get_pools()
+        print("Found all those pools: ", pools)
+
+        print(await asyncio.gather(*(client.get_ICO_details(p['id']) for p in pools)))
+        print(await asyncio.gather(*(client.get_last_pool_measures(p['id']) for p in pools)))
+
+
+asyncio.run(main())
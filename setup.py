@@ -22,4 +22,8 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     install_requires=["requests", "requests_oauthlib", "oauthlib"],
+    extras_require={
+        "async": ["httpx[http2]", "authlib"],
+        "fast": ["brotli", "orjson"],
+    },
 )
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from typing import Any, Optional, Union, Callable, Dict, Iterable, Tuple
+
+import httpx
+from authlib.integrations.httpx_client import AsyncOAuth2Client
+
+from .ondilo import (
+    API_HOST,
+    API_URL,
+    ENDPOINT_TOKEN,
+    ENDPOINT_AUTHORIZE,
+    DEFAULT_CLIENT_ID,
+    DEFAULT_CLIENT_SECRET,
+    DEFAULT_SCOPE,
+    TOKEN_EXPIRY_MARGIN,
+    POOL_BUNDLE_PARTS,
+    USER_CACHE_TTL,
+    OndiloError,
+    _lastmeasures_qs,
+    _pool_bundle_getters,
+    _error_message,
+    json_loads,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+
+class AsyncOndilo:
+    """Asynchronous Ondilo API client, mirroring the methods of Ondilo.
+
+    A single HTTP/2 connection pool is held for the lifetime of the client, so
+    calls issued concurrently (e.g. with asyncio.gather) are multiplexed over
+    the same connection. Its size can be tuned with limits. Close the client
+    with aclose() or use it as an async context manager.
+    """
+    __slots__ = (
+        "host",
+        "client_id",
+        "client_secret",
+        "redirect_uri",
+        "token_updater",
+        "scope",
+        "_oauth",
+        "_cache",
+    )
+
+    def __init__(
+        self,
+        token: Optional[Dict[str, str]] = None,
+        client_id: str = DEFAULT_CLIENT_ID,
+        client_secret: str = DEFAULT_CLIENT_SECRET,
+        redirect_uri: str = None,
+        token_updater: Optional[Callable[[str], None]] = None,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+    ):
+        self.host = API_HOST
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.token_updater = token_updater
+        self.scope = DEFAULT_SCOPE
+
+        if token_updater is None:
+            _LOGGER.debug(
+                "No token_updater given, fetched and refreshed tokens will only "
+                "be kept in memory"
+            )
+
+        self._oauth = AsyncOAuth2Client(
+            client_id=client_id,
+            client_secret=client_secret,
+            token_endpoint_auth_method="client_secret_post",
+            scope=self.scope,
+            redirect_uri=redirect_uri,
+            token=token,
+            update_token=self._update_token,
+            leeway=TOKEN_EXPIRY_MARGIN,
+            token_endpoint=f"{self.host}{ENDPOINT_TOKEN}",
+            base_url=API_URL,
+            http2=True,
+            limits=limits,
+        )
+        self._cache: Dict[str, Tuple[float, bytes]] = {}
+
+    async def __aenter__(self) -> "AsyncOndilo":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP connections."""
+        await self._oauth.aclose()
+
+    async def _update_token(self, token, refresh_token=None, access_token=None):
+        if self.token_updater is not None:
+            self.token_updater(token)
+
+    async def refresh_tokens(self) -> Dict[str, Union[str, int]]:
+        """Refresh and return new tokens."""
+        return await self._oauth.refresh_token(f"{self.host}{ENDPOINT_TOKEN}")
+
+    async def request_token(
+        self,
+        authorization_response: Optional[str] = None,
+        code: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """
+        Generic method for fetching an access token.
+        :param authorization_response: Authorization response URL, the callback
+                                       URL of the request back to you.
+        :param code: Authorization code
+        :return: A token dict
+        """
+        token = await self._oauth.fetch_token(
+            f"{self.host}{ENDPOINT_TOKEN}",
+            authorization_response=authorization_response,
+            code=code,
+        )
+
+        self.invalidate_cache()
+        if self.token_updater is not None:
+            self.token_updater(token)
+
+        return token
+
+    def set_token(self, token: Dict[str, Union[str, int]]) -> None:
+        """
+        Use a previously persisted token, without refreshing it.
+        It will only be refreshed once it is about to expire.
+        :param token: A token dict, as given to token_updater
+        """
+        self._oauth.token = token
+        self.invalidate_cache()
+
+    def get_authurl(self):
+        """Get the URL needed for the authorization code grant flow."""
+        authorization_url, _ = self._oauth.create_authorization_url(
+            f"{self.host}{ENDPOINT_AUTHORIZE}"
+        )
+        return authorization_url
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Make a request.
+
+        The token is refreshed ahead of its expiry by the OAuth2 client, and
+        token_updater is called with the new token.
+        """
+        return await self._oauth.request(method, path, **kwargs)
+
+    async def _request_content(self, method: str, path: str, **kwargs) -> bytes:
+        """Make a request and return its raw body.
+
+        Raises:
+            OndiloError: If the API does not answer with a 200 status code.
+        """
+        req = await self.request(method, path, **kwargs)
+
+        if req.status_code != 200:
+            raise OndiloError(req.status_code, _error_message(req.content))
+
+        return req.content
+
+    async def _request_json(self, method: str, path: str, **kwargs) -> Any:
+        """Make a request and return its decoded JSON body."""
+        return json_loads(await self._request_content(method, path, **kwargs))
+
+    async def _cached_get(self, path: str, ttl: float) -> Any:
+        """GET path, reusing the response body for ttl seconds.
+
+        The body is decoded on each call, so that callers can't alter the cached value.
+        """
+        cached = self._cache.get(path)
+        if cached is None or cached[0] <= time.monotonic():
+            cached = (time.monotonic() + ttl, await self._request_content("get", path))
+            self._cache[path] = cached
+
+        return json_loads(cached[1])
+
+    def invalidate_cache(self) -> None:
+        """Drop cached user units and info, so that they are fetched again."""
+        self._cache.clear()
+
+    async def get_pools(self):
+        """Get all pools/spas associated with the user."""
+        return await self._request_json("get", "/pools")
+
+    async def get_ICO_details(self, pool_id: int) -> dict:
+        """Retrieves the details of an ICO device associated with a specific pool."""
+        return await self._request_json("get", f"/pools/{pool_id}/device")
+
+    async def get_last_pool_measures(
+        self, pool_id: int, types: Optional[Iterable[str]] = None
+    ) -> dict:
+        """Retrieves the last measures of a specific pool, optionally only some types."""
+        qstr = _lastmeasures_qs(types)
+        return await self._request_json("get", f"/pools/{pool_id}/lastmeasures{qstr}")
+
+    async def get_pool_recommendations(self, pool_id: int) -> dict:
+        """Retrieves the recommendations for a specific pool."""
+        return await self._request_json("get", f"/pools/{pool_id}/recommendations")
+
+    async def validate_pool_recommendation(self, pool_id: int, recommendation_id: int) -> str:
+        """Validates a pool recommendation."""
+        return await self._request_json("put", f"/pools/{pool_id}/recommendations/{recommendation_id}")
+
+    async def get_user_units(self) -> dict:
+        """Retrieves the units of measurement for the user."""
+        return await self._cached_get("/user/units", USER_CACHE_TTL)
+
+    async def get_user_info(self) -> dict:
+        """Retrieves the user information from the Ondilo API."""
+        return await self._cached_get("/user/info", USER_CACHE_TTL)
+
+    async def get_pool_config(self, pool_id: int) -> dict:
+        """Retrieves the configuration of a pool."""
+        return await self._request_json("get", f"/pools/{pool_id}/configuration")
+
+    async def get_pool_shares(self, pool_id: int) -> dict:
+        """Retrieves the shares of a specific pool."""
+        return await self._request_json("get", f"/pools/{pool_id}/shares")
+
+    async def get_pool_histo(self, pool_id: int, measure: str, period: str) -> dict:
+        """Retrieves the historical data for a specific pool."""
+        return await self._request_json("get", f"/pools/{pool_id}/measures?type={measure}&period={period}")
+
+    async def get_pool_bundle(
+        self, pool_id: int, parts: Iterable[str] = POOL_BUNDLE_PARTS
+    ) -> dict:
+        """Retrieves several endpoints of a specific pool concurrently, see Ondilo.get_pool_bundle."""
+        getters = _pool_bundle_getters(parts)
+        results = await asyncio.gather(
+            *(getattr(self, getter)(pool_id) for getter in getters.values())
+        )
+        return dict(zip(getters, results))
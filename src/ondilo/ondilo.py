@@ -1,8 +1,23 @@
-from typing import Optional, Union, Callable, Dict
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Optional, Union, Callable, Dict, Iterable, Tuple
+from urllib.parse import urlencode
 
 from requests import Response
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import TokenExpiredError
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+_LOGGER = logging.getLogger(__name__)
 
 API_HOST = "https://interop.ondilo.com"
 API_URL = API_HOST + "/api/customer/v1"
@@ -11,6 +26,12 @@ ENDPOINT_AUTHORIZE = "/oauth2/authorize"
 DEFAULT_CLIENT_ID = "customer_api"
 DEFAULT_CLIENT_SECRET = ""
 DEFAULT_SCOPE = "api"
+TOKEN_EXPIRY_MARGIN = 30
+DEFAULT_POOL_SIZE = 10
+ERROR_MESSAGE_MAX = 1024
+USER_CACHE_TTL = 3600
+LASTMEASURES_TYPES = ("temperature", "ph", "orp", "salt", "battery", "tds", "rssi")
+POOL_BUNDLE_PARTS = ("device", "lastmeasures", "recommendations", "configuration")
 
 
 class OndiloError(Exception):
@@ -23,8 +44,70 @@ class OndiloError(Exception):
         return f"{self.status_code}: {self.message}"
 
 
+@lru_cache(maxsize=16)
+def _build_lastmeasures_qs(types: Tuple[str, ...]) -> str:
+    """Build the query string selecting the measure types of lastmeasures."""
+    return "?" + urlencode([("types[]", t) for t in types], safe="[]")
+
+
+def _lastmeasures_qs(types: Optional[Iterable[str]]) -> str:
+    """Validate the requested measure types and return their query string."""
+    if types is None:
+        return _build_lastmeasures_qs(LASTMEASURES_TYPES)
+    if isinstance(types, str):
+        raise ValueError("types must be an iterable of measure types, not a string")
+
+    types = tuple(types)
+    if not types:
+        raise ValueError("types must contain at least one measure type")
+
+    return _build_lastmeasures_qs(types)
+
+
+# Name of the client method fetching each part of get_pool_bundle
+_POOL_BUNDLE_GETTERS = {
+    "device": "get_ICO_details",
+    "lastmeasures": "get_last_pool_measures",
+    "recommendations": "get_pool_recommendations",
+    "configuration": "get_pool_config",
+}
+
+
+def _pool_bundle_getters(parts: Iterable[str]) -> Dict[str, str]:
+    """Validate and deduplicate bundle parts, mapping them to their getter name."""
+    parts = tuple(dict.fromkeys(parts))
+    unknown = set(parts) - _POOL_BUNDLE_GETTERS.keys()
+    if unknown:
+        raise ValueError(f"Unknown pool bundle parts: {', '.join(sorted(unknown))}")
+
+    return {part: _POOL_BUNDLE_GETTERS[part] for part in parts}
+
+
+def _error_message(content: bytes) -> str:
+    """Decode the start of an error body, without guessing its encoding."""
+    return content[:ERROR_MESSAGE_MAX].decode("utf-8", "replace")
+
+
 class Ondilo:
     """Ondilo API client. Handles OAuth2 authorization and API requests."""
+    __slots__ = (
+        "host",
+        "client_id",
+        "client_secret",
+        "redirect_uri",
+        "token_updater",
+        "scope",
+        "_oauth",
+        "_refresh_lock",
+        "_refresh_inflight",
+        "_cache",
+    )
+
+    # Shared by all clients so that bundled calls don't spawn threads each time
+    _executor = ThreadPoolExecutor(
+        max_workers=len(POOL_BUNDLE_PARTS), thread_name_prefix="ondilo"
+    )
+
     def __init__(
         self,
         token: Optional[Dict[str, str]] = None,
@@ -32,7 +115,19 @@ class Ondilo:
         client_secret: str = DEFAULT_CLIENT_SECRET,
         redirect_uri: str = None,
         token_updater: Optional[Callable[[str], None]] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
     ):
+        """
+        :param token: A token dict, e.g. as previously given to token_updater
+        :param client_id: OAuth2 client ID
+        :param client_secret: OAuth2 client secret
+        :param redirect_uri: Callback URL of the authorization code grant flow
+        :param token_updater: Called with each fetched or refreshed token
+        :param pool_size: Number of kept-alive connections to the API. Below
+                          len(POOL_BUNDLE_PARTS), get_pool_bundle opens extra
+                          connections that urllib3 then discards
+                          ("Connection pool is full").
+        """
         self.host = API_HOST
         self.client_id = client_id
         self.client_secret = client_secret
@@ -40,6 +135,12 @@ class Ondilo:
         self.token_updater = token_updater
         self.scope = DEFAULT_SCOPE
 
+        if token_updater is None:
+            _LOGGER.debug(
+                "No token_updater given, fetched and refreshed tokens will only "
+                "be kept in memory"
+            )
+
         extra = {"client_id": self.client_id, "client_secret": self.client_secret}
 
         self._oauth = OAuth2Session(
@@ -51,12 +152,71 @@ class Ondilo:
             scope=self.scope,
         )
 
+        # Keep connections to the API alive and reusable across threads
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        self._oauth.mount("https://", adapter)
+
+        self._refresh_lock = threading.Lock()
+        self._refresh_inflight: Optional[Future] = None
+        self._cache: Dict[str, Tuple[float, bytes]] = {}
+
     def refresh_tokens(self) -> Dict[str, Union[str, int]]:
-        """Refresh and return new tokens."""
-        token = self._oauth.refresh_token(f"{self.host}{ENDPOINT_TOKEN}")
+        """Refresh and return new tokens.
 
-        if self.token_updater is not None:
-            self.token_updater(token)
+        Concurrent callers share a single in-flight refresh, so that only one
+        refresh token request is made when several threads hit an expired token.
+        token_updater is called with the new token before any caller gets it.
+        """
+        return self._refresh(skip_if_fresh=False)
+
+    def _refresh_if_needed(self) -> Dict[str, Union[str, int]]:
+        """Refresh tokens, unless the current token is not about to expire anymore.
+
+        This covers threads that saw an expiring token while another thread
+        was already refreshing it.
+        """
+        return self._refresh(skip_if_fresh=True)
+
+    def _refresh(self, skip_if_fresh: bool) -> Dict[str, Union[str, int]]:
+        with self._refresh_lock:
+            inflight = self._refresh_inflight
+            if inflight is None:
+                current = self._oauth.token or {}
+                expires_at = current.get("expires_at")
+                if (
+                    skip_if_fresh
+                    and expires_at is not None
+                    and float(expires_at) - time.time() >= TOKEN_EXPIRY_MARGIN
+                ):
+                    return current
+
+                future = self._refresh_inflight = Future()
+
+        if inflight is not None:
+            return inflight.result()
+
+        try:
+            token = self._oauth.refresh_token(f"{self.host}{ENDPOINT_TOKEN}")
+
+            if self.token_updater is not None:
+                self.token_updater(token)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(token)
+        finally:
+            with self._refresh_lock:
+                self._refresh_inflight = None
 
         return token
 
@@ -72,13 +232,28 @@ class Ondilo:
         :param code: Authorization code
         :return: A token dict
         """
-        return self._oauth.fetch_token(
+        token = self._oauth.fetch_token(
             f"{self.host}{ENDPOINT_TOKEN}",
             authorization_response=authorization_response,
             code=code,
             include_client_id=True,
         )
 
+        self.invalidate_cache()
+        if self.token_updater is not None:
+            self.token_updater(token)
+
+        return token
+
+    def set_token(self, token: Dict[str, Union[str, int]]) -> None:
+        """
+        Use a previously persisted token, without refreshing it.
+        It will only be refreshed once it is about to expire.
+        :param token: A token dict, as given to token_updater
+        """
+        self._oauth.token = token
+        self.invalidate_cache()
+
     def get_authurl(self):
         """Get the URL needed for the authorization code grant flow."""
         authorization_url, _ = self._oauth.authorization_url(
@@ -93,21 +268,59 @@ class Ondilo:
         we want to allow overriding the token refresh logic.
         """
         url = f"{API_URL}{path}"
+        token = self._oauth.token or {}
+        expires_at = token.get("expires_at")
+        if (
+            expires_at is not None
+            and token.get("refresh_token")
+            and float(expires_at) - time.time() < TOKEN_EXPIRY_MARGIN
+        ):
+            # Refresh ahead of expiry to save the round trip of a rejected call
+            self._oauth.token = self._refresh_if_needed()
+
         try:
-            return getattr(self._oauth, method)(url, **kwargs)
+            return self._oauth.request(method, url, **kwargs)
         except TokenExpiredError:
-            self._oauth.token = self.refresh_tokens()
+            self._oauth.token = self._refresh_if_needed()
 
-            return getattr(self._oauth, method)(url, **kwargs)
+        return self._oauth.request(method, url, **kwargs)
 
-    def get_pools(self):
-        """Get all pools/spas associated with the user."""
-        req = self.request("get", "/pools")
+    def _request_content(self, method: str, path: str, **kwargs) -> bytes:
+        """Make a request and return its raw body.
+
+        Raises:
+            OndiloError: If the API does not answer with a 200 status code.
+        """
+        req = self.request(method, path, **kwargs)
 
         if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
+            raise OndiloError(req.status_code, _error_message(req.content))
+
+        return req.content
+
+    def _request_json(self, method: str, path: str, **kwargs) -> Any:
+        """Make a request and return its decoded JSON body."""
+        return json_loads(self._request_content(method, path, **kwargs))
+
+    def _cached_get(self, path: str, ttl: float) -> Any:
+        """GET path, reusing the response body for ttl seconds.
+
+        The body is decoded on each call, so that callers can't alter the cached value.
+        """
+        cached = self._cache.get(path)
+        if cached is None or cached[0] <= time.monotonic():
+            cached = (time.monotonic() + ttl, self._request_content("get", path))
+            self._cache[path] = cached
 
-        return req.json()
+        return json_loads(cached[1])
+
+    def invalidate_cache(self) -> None:
+        """Drop cached user units and info, so that they are fetched again."""
+        self._cache.clear()
+
+    def get_pools(self):
+        """Get all pools/spas associated with the user."""
+        return self._request_json("get", "/pools")
 
     def get_ICO_details(self, pool_id: int) -> dict:
         """
@@ -122,33 +335,28 @@ class Ondilo:
         Raises:
             OndiloError: If the request to retrieve the device details fails.
         """
-        req = self.request("get", "/pools/" + str(pool_id) + "/device")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._request_json("get", f"/pools/{pool_id}/device")
 
-    def get_last_pool_measures(self, pool_id: int) -> dict:
+    def get_last_pool_measures(
+        self, pool_id: int, types: Optional[Iterable[str]] = None
+    ) -> dict:
         """
         Retrieves the last measures of a specific pool.
 
         Args:
             pool_id (int): The ID of the pool.
+            types (Iterable[str], optional): The measure types to retrieve.
+                Defaults to all of LASTMEASURES_TYPES.
 
         Returns:
             dict: A dictionary containing the last measures for the pool.
 
         Raises:
+            ValueError: If types is a string or is empty.
             OndiloError: If the request to retrieve the last measures fails.
         """
-        qstr = "?types[]=temperature&types[]=ph&types[]=orp&types[]=salt&types[]=battery&types[]=tds&types[]=rssi"
-        req = self.request("get", f"/pools/{str(pool_id)}/lastmeasures{qstr}")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        qstr = _lastmeasures_qs(types)
+        return self._request_json("get", f"/pools/{pool_id}/lastmeasures{qstr}")
 
     def get_pool_recommendations(self, pool_id: int) -> dict:
         """
@@ -163,12 +371,7 @@ class Ondilo:
         Raises:
             OndiloError: If the request to retrieve the recommendations fails.
         """
-        req = self.request("get", "/pools/" + str(pool_id) + "/recommendations")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._request_json("get", f"/pools/{pool_id}/recommendations")
 
     def validate_pool_recommendation(self, pool_id: int, recommendation_id: int) -> str:
         """
@@ -184,44 +387,31 @@ class Ondilo:
         Raises:
             OndiloError: If the API request fails.
         """
-        req = self.request("put", "/pools/" + str(pool_id) + "/recommendations/" + str(recommendation_id))
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._request_json("put", f"/pools/{pool_id}/recommendations/{recommendation_id}")
 
     def get_user_units(self) -> dict:
         """
         Retrieves the units of measurement for the user.
+        The result is cached for an hour, see invalidate_cache.
 
         Returns:
             A dictionary containing the user's units of measurement.
         Raises:
             OndiloError: If the request to retrieve the units fails.
         """
-        req = self.request("get", "/user/units")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._cached_get("/user/units", USER_CACHE_TTL)
 
     def get_user_info(self) -> dict:
         """
         Retrieves the user information from the Ondilo API.
+        The result is cached for an hour, see invalidate_cache.
 
         Returns:
             A dictionary containing the user information.
         Raises:
             OndiloError: If the request to retrieve the user info fails.
         """
-        req = self.request("get", "/user/info")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._cached_get("/user/info", USER_CACHE_TTL)
 
     def get_pool_config(self, pool_id: int) -> dict:
         """
@@ -236,12 +426,7 @@ class Ondilo:
         Raises:
             OndiloError: If the request to retrieve the configuration fails.
         """
-        req = self.request("get", "/pools/" + str(pool_id) + "/configuration")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._request_json("get", f"/pools/{pool_id}/configuration")
 
     def get_pool_shares(self, pool_id: int) -> dict:
         """
@@ -256,12 +441,7 @@ class Ondilo:
         Raises:
             OndiloError: If the request to retrieve the shares fails.
         """
-        req = self.request("get", "/pools/" + str(pool_id) + "/shares")
-
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
-
-        return req.json()
+        return self._request_json("get", f"/pools/{pool_id}/shares")
 
     def get_pool_histo(self, pool_id: int, measure: str, period: str) -> dict:
         """
@@ -278,9 +458,30 @@ class Ondilo:
         Raises:
             OndiloError: If the request to retrieve the historical data fails.
         """
-        req = self.request("get", "/pools/" + str(pool_id) + "/measures?type=" + measure + "&period=" + period)
+        return self._request_json("get", f"/pools/{pool_id}/measures?type={measure}&period={period}")
 
-        if req.status_code != 200:
-            raise OndiloError(req.status_code, req.text)
+    def get_pool_bundle(
+        self, pool_id: int, parts: Iterable[str] = POOL_BUNDLE_PARTS
+    ) -> dict:
+        """
+        Retrieves several endpoints of a specific pool concurrently.
+        Calls run on a thread pool shared by all clients, with at most
+        len(POOL_BUNDLE_PARTS) workers.
+
+        Args:
+            pool_id (int): The ID of the pool.
+            parts (Iterable[str]): The endpoints to retrieve, among "device",
+                "lastmeasures", "recommendations" and "configuration".
+
+        Returns:
+            dict: A dictionary mapping each part to its API response.
 
-        return req.json()
+        Raises:
+            ValueError: If an unknown part is requested.
+            OndiloError: If one of the requests fails.
+        """
+        futures = {
+            part: self._executor.submit(getattr(self, getter), pool_id)
+            for part, getter in _pool_bundle_getters(parts).items()
+        }
+        return {part: future.result() for part, future in futures.items()}